@@ -1,39 +1,95 @@
 from dotenv import load_dotenv
 import pathlib
 import uvicorn
-import re  # Import regex module
-from fastapi import FastAPI, Request, Form, HTTPException, Header, APIRouter
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi import (
+    FastAPI, Request, Form, HTTPException, Header, APIRouter, BackgroundTasks, Path
+)
+from fastapi.responses import (
+    HTMLResponse, FileResponse, JSONResponse, RedirectResponse, Response
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from typing import Optional
-import urllib.parse
-from rapidfuzz import fuzz
+from jinja2 import FileSystemBytecodeCache
+from typing import NamedTuple, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import quote_plus
+from rapidfuzz import fuzz, process
 import hmac
-import hashlib
-import json
-import subprocess
+import orjson
+from binascii import hexlify
+import anyio
+import asyncio
+import atexit
+import fcntl
+import logging
+import logging.handlers
 import os
+import queue
+import sys
+import threading
 
 
 # Load environment variables from the .env file
 load_dotenv()
 
+# --- Logging ---
+# Request handlers only enqueue log records; a background listener thread
+# formats them and writes them to stdout, so a slow log file never blocks
+# the event loop.
+logger = logging.getLogger("dipy.services")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream_handler = logging.StreamHandler(sys.stdout)
+_log_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+)
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 # --- Configuration ---
 CERTIFICATES_DIR = pathlib.Path("certificates")
 STATIC_DIR = pathlib.Path("static")
 TEMPLATES_DIR = pathlib.Path("templates")
 SUPPORTED_YEARS = list(range(2023, 2027))  # Years 2023-2026
+SUPPORTED_YEAR_STRINGS = frozenset(str(year) for year in SUPPORTED_YEARS)
+# Patterns checked by FastAPI on route parameters, before the handler runs.
+# A name stem may hold any character except path separators, and may not
+# start with a dot, so ".." and hidden files are rejected outright.
+YEAR_PARAM_PATTERN = r"^\d{4}$"
+NAME_STEM_PARAM_PATTERN = r"^[^./\\][^/\\]*$"
 LINKEDIN_CERT_URL = (
     "https://www.linkedin.com/profile/add?startTask=CERTIFICATION_NAME"
 )
 ORGANIZATION_ID = "18898741"  # DIPY LinkedIn Organization ID
 ISSUE_MONTH = "5"      # Default Issue Month - Still used for LinkedIn link
+# LinkedIn link with the parameters that are the same for every certificate
+LINKEDIN_STATIC_URL = (
+    f"{LINKEDIN_CERT_URL}&organizationId={ORGANIZATION_ID}&issueMonth={ISSUE_MONTH}"
+)
+
+# Number of search results remembered per year
+SEARCH_CACHE_SIZE = 2048
+# Certificate routes scan folders, fuzzy match and stat files, so they run in
+# a threadpool of this size instead of blocking the event loop
+CERTIFICATE_THREADPOOL_SIZE = 100
+# Certificates can be re-issued under the same name, so browsers may reuse a
+# copy for a day and then revalidate it with its ETag
+CERTIFICATE_CACHE_CONTROL = "public, max-age=86400"
 
 # GitHub webhook settings
 GITHUB_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+# Keyed once here; each delivery copies this HMAC instead of re-deriving the
+# inner and outer key pads from the secret
+_GITHUB_HMAC = (
+    hmac.new(GITHUB_SECRET.encode(), digestmod="sha256") if GITHUB_SECRET else None
+)
 UPDATE_LAB_SCRIPT_PATH = pathlib.Path("update_lab_website.sh")
 UPDATE_WORKSHOP_SCRIPT_PATH = pathlib.Path("update_workshop.sh")
+MAX_WEBHOOK_BYTES = 25 * 1024 * 1024  # GitHub caps webhook payloads at 25 MB
 
 # Create directories if they don't exist
 CERTIFICATES_DIR.mkdir(exist_ok=True)
@@ -41,7 +97,20 @@ STATIC_DIR.mkdir(exist_ok=True)
 TEMPLATES_DIR.mkdir(exist_ok=True)
 
 # --- FastAPI App Setup ---
-app = FastAPI(title="DIPY Services server")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Walk the certificate folders once at startup so that the first search
+    # of each year does not pay for it.
+    warm_certificate_index()
+    # Certificate routes are plain functions that FastAPI runs in the anyio
+    # threadpool; allow more of them to run at once than the default 40.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = (
+        CERTIFICATE_THREADPOOL_SIZE
+    )
+    yield
+
+
+app = FastAPI(title="DIPY Services server", lifespan=lifespan)
 
 # Create routers for different services
 # Prefixes here will be combined with the prefix in app.include_router
@@ -56,9 +125,219 @@ def root_url_for(request: Request, name: str, **params):
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 templates.env.globals["root_url_for"] = root_url_for
+# Compiled templates are shared between workers and restarts through a
+# per-user cache directory, and are not re-stat'ed on every render
+# (restart the app after editing a template).
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = False
+
+
+# --- Responses ---
+class OrjsonResponse(JSONResponse):
+    """
+    JSONResponse serialized with orjson instead of the stdlib json module.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+class CertificateFileResponse(FileResponse):
+    """
+    FileResponse streaming certificate PDFs in 256 KiB chunks.
+
+    Certificate PDFs are usually larger than the default 64 KiB chunk, so
+    bigger reads send them with fewer file reads and event loop round trips.
+    """
+    chunk_size = 256 * 1024
+
+
+def certificate_file_response(
+    request: Request,
+    certificate_path: pathlib.Path,
+    content_disposition_type: str
+) -> Response:
+    """
+    Serve a certificate PDF with validators and caching headers.
+
+    The ETag is derived from the file's mtime and size, so a re-issued
+    certificate gets a new one. Clients that send a matching If-None-Match
+    get an empty 304 response instead of the file.
+
+    Parameters
+    ----------
+    request : Request
+        The incoming request object.
+    certificate_path : pathlib.Path
+        The certificate file to serve.
+    content_disposition_type : str
+        Either "attachment" (download) or "inline" (view in browser).
+
+    Returns
+    -------
+    Response
+        A CertificateFileResponse, or a 304 Not Modified response.
+    """
+    stat_result = certificate_path.stat()
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": CERTIFICATE_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip().removeprefix("W/")
+                    for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+
+    return CertificateFileResponse(
+        path=certificate_path,
+        headers=headers,
+        filename=certificate_path.name,
+        media_type='application/pdf',
+        stat_result=stat_result,
+        content_disposition_type=content_disposition_type
+    )
 
 
 # --- Helper Functions ---
+class _YearIndex(NamedTuple):
+    """Cached listing of the certificate PDFs of one year folder."""
+    # st_mtime_ns of every directory walked, used to detect changes
+    dir_mtimes: dict[str, int]
+    # Lowercased stems, precomputed once for fuzzy matching
+    stems_lower: list[str]
+    # PDF paths, in the same order as stems_lower
+    paths: list[pathlib.Path]
+    # Exact stem -> path, for direct lookups
+    by_stem: dict[str, pathlib.Path]
+    # Lowercased stem -> path, for exact case-insensitive search hits
+    by_stem_lower: dict[str, pathlib.Path]
+    # (query, threshold) -> find_certificate result, in LRU order
+    search_cache: OrderedDict[tuple[str, int], Optional[pathlib.Path]]
+
+
+# Guards the search_cache of every year index, since certificate routes run
+# in the threadpool
+_search_cache_lock = threading.Lock()
+
+# Per-year cache of certificate PDFs. The listing of a year is only rebuilt
+# when a file is added, removed or renamed somewhere in its tree.
+_cert_index: dict[str, _YearIndex] = {}
+
+
+def _index_is_fresh(dir_mtimes: dict[str, int]) -> bool:
+    try:
+        return all(
+            os.stat(directory).st_mtime_ns == mtime
+            for directory, mtime in dir_mtimes.items()
+        )
+    except FileNotFoundError:
+        return False
+
+
+def _scan_pdfs(
+    directory: str,
+    dir_mtimes: dict[str, int],
+    entries: list[tuple[str, pathlib.Path]],
+):
+    # DirEntry caches the file type reported by the OS, so unlike rglob
+    # followed by is_file() this needs no extra stat() per file.
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                dir_mtimes[entry.path] = entry.stat(
+                    follow_symlinks=False).st_mtime_ns
+                _scan_pdfs(entry.path, dir_mtimes, entries)
+            elif entry.name.endswith(".pdf") and entry.is_file():
+                entries.append((entry.name[:-4], pathlib.Path(entry.path)))
+
+
+def _get_year_index(search_year: str, year_dir: pathlib.Path) -> _YearIndex:
+    """
+    Return the certificate PDFs of a year folder, walking it only when needed.
+
+    Parameters
+    ----------
+    search_year : str
+        The year used as cache key.
+    year_dir : pathlib.Path
+        The directory containing the certificates of that year.
+
+    Returns
+    -------
+    _YearIndex
+        The PDF files found recursively within ``year_dir``, sorted by stem
+        and then path so that results do not depend on the directory order
+        of the filesystem. If several files share a stem, the lookup dicts
+        hold the first one.
+    """
+    cached = _cert_index.get(search_year)
+    if cached is not None and _index_is_fresh(cached.dir_mtimes):
+        return cached
+
+    dir_mtimes = {str(year_dir): year_dir.stat().st_mtime_ns}
+    entries = []
+    _scan_pdfs(str(year_dir), dir_mtimes, entries)
+    entries.sort()
+    stems_lower = [stem.lower() for stem, _ in entries]
+    by_stem = {}
+    by_stem_lower = {}
+    for (stem, path), stem_lower in zip(entries, stems_lower):
+        by_stem.setdefault(stem, path)
+        by_stem_lower.setdefault(stem_lower, path)
+
+    index = _YearIndex(
+        dir_mtimes=dir_mtimes,
+        stems_lower=stems_lower,
+        paths=[path for _, path in entries],
+        by_stem=by_stem,
+        by_stem_lower=by_stem_lower,
+        search_cache=OrderedDict(),
+    )
+    _cert_index[search_year] = index
+    return index
+
+
+def warm_certificate_index():
+    """
+    Build the cached certificate listing of every supported year.
+    """
+    for year in SUPPORTED_YEARS:
+        year_dir = CERTIFICATES_DIR / str(year)
+        if year_dir.is_dir():
+            _get_year_index(str(year), year_dir)
+
+
+def _get_year_dir(search_year: str) -> Optional[pathlib.Path]:
+    if search_year not in SUPPORTED_YEAR_STRINGS:
+        logger.warning("Invalid or unsupported year received: %s", search_year)
+        return None
+
+    year_dir = CERTIFICATES_DIR / search_year
+    if not year_dir.is_dir():
+        logger.warning(
+            "Certificate directory for year '%s' not found at %s",
+            search_year, year_dir
+        )
+        return None
+    return year_dir
+
+
+def invalidate_certificate_index(year: Optional[str] = None):
+    """
+    Drop the cached certificate listing of one year, or of all years.
+
+    Parameters
+    ----------
+    year : str, optional
+        The year to invalidate. Default is None, which clears every year.
+    """
+    if year is None:
+        _cert_index.clear()
+    else:
+        _cert_index.pop(year, None)
+
+
 def find_certificate(
     search_name: str, search_year: str, min_score_threshold: int = 70
 ) -> Optional[pathlib.Path]:
@@ -77,7 +356,8 @@ def find_certificate(
     search_name : str
         The name to search for (case-insensitive).
     search_year : str
-        The specific year subfolder to search within (must be 4 digits).
+        The specific year subfolder to search within (must be one of
+        SUPPORTED_YEARS).
     min_score_threshold : int, optional
         The minimum similarity score (0-100) required for a match
         to be considered valid. Default is 70.
@@ -91,57 +371,121 @@ def find_certificate(
     # Validate inputs
     if not search_name or not search_year:
         return None
-    if not re.fullmatch(r'\d{4}', search_year):
-        print(f"Warning: Invalid year format received: {search_year}")
+    year_dir = _get_year_dir(search_year)
+    if year_dir is None:
         return None
 
-    year_dir = CERTIFICATES_DIR / search_year
-    if not year_dir.is_dir():
-        print(
-            f"Warning: Certificate directory for year '{search_year}' "
-            f"not found at {year_dir}"
-        )
-        return None
-
-    search_lower = search_name.lower()
-    best_match_path = None
-    highest_score = -1
+    # Surrounding spaces and case do not change which certificate is meant
+    search_lower = search_name.strip().lower()
 
     try:
-        # Use rglob to search recursively within the specific year directory
-        for item in year_dir.rglob("*.pdf"):
-            if item.is_file():
-                stem_lower = item.stem.lower()
-                # Calculate partial ratio similarity score
-                score = fuzz.partial_ratio(search_lower, stem_lower)
-
-                # Check if this score is the best so far
-                if score > highest_score:
-                    highest_score = score
-                    best_match_path = item
-
+        # The listing is cached and only re-walked when the year tree changes
+        index = _get_year_index(search_year, year_dir)
     except FileNotFoundError:
         # This specific error shouldn't happen due to the is_dir check above,
         # but added for robustness.
-        print(f"Error: Unexpected FileNotFoundError while searching in {year_dir}")
+        logger.error("Unexpected FileNotFoundError while searching in %s", year_dir)
         return None
 
+    # Results live on the year index, so they are dropped with it whenever
+    # the certificate folder changes.
+    cache_key = (search_lower, min_score_threshold)
+    with _search_cache_lock:
+        if cache_key in index.search_cache:
+            index.search_cache.move_to_end(cache_key)
+            return index.search_cache[cache_key]
+
+    best_match_path = _match_certificate(
+        index, search_lower, search_name, search_year, min_score_threshold
+    )
+
+    with _search_cache_lock:
+        index.search_cache[cache_key] = best_match_path
+        if len(index.search_cache) > SEARCH_CACHE_SIZE:
+            index.search_cache.popitem(last=False)
+    return best_match_path
+
+
+def _match_certificate(
+    index: _YearIndex,
+    search_lower: str,
+    search_name: str,
+    search_year: str,
+    min_score_threshold: int
+) -> Optional[pathlib.Path]:
+    # A query naming a certificate exactly needs no fuzzy matching
+    exact_match = index.by_stem_lower.get(search_lower)
+    if exact_match is not None:
+        logger.debug(
+            "Exact match found: '%s' in year %s for query '%s'",
+            exact_match.name, search_year, search_name
+        )
+        return exact_match
+
+    # Score all stems in one call; rapidfuzz runs the loop in C++ and skips
+    # candidates that cannot reach the minimum score threshold.
+    match = process.extractOne(
+        search_lower,
+        index.stems_lower,
+        scorer=fuzz.partial_ratio,
+        score_cutoff=min_score_threshold,
+    )
+
     # Return the best match only if it meets the minimum score threshold
-    if highest_score >= min_score_threshold:
-        print(
-            f"Best match found: '{best_match_path.name}' in year {search_year}"
-            f" with score {highest_score} for query '{search_name}'"
+    if match is not None:
+        _, highest_score, position = match
+        best_match_path = index.paths[position]
+        logger.debug(
+            "Best match found: '%s' in year %s with score %s for query '%s'",
+            best_match_path.name, search_year, highest_score, search_name
         )
         return best_match_path
     else:
-        print(
-            f"No match found in year {search_year} above threshold "
-            f"{min_score_threshold} for query '{search_name}'. "
-            f"Highest score: {highest_score}"
+        logger.debug(
+            "No match found in year %s above threshold %s for query '%s'.",
+            search_year, min_score_threshold, search_name
         )
         return None
 
 
+def get_certificate_by_stem(
+    name_stem: str, year: str
+) -> Optional[pathlib.Path]:
+    """
+    Look up a certificate PDF by its exact stem within a specific year folder.
+
+    Unlike find_certificate, no fuzzy matching is involved: this is a
+    dictionary lookup in the cached year index, meant for routes that
+    already know the exact file name.
+
+    Parameters
+    ----------
+    name_stem : str
+        The exact stem (filename without extension) of the certificate.
+    year : str
+        The specific year subfolder to search within (must be one of
+        SUPPORTED_YEARS).
+
+    Returns
+    -------
+    Optional[pathlib.Path]
+        The Path object of the certificate file, or None if there is no
+        certificate with that stem in that year.
+    """
+    if not name_stem or not year:
+        return None
+    year_dir = _get_year_dir(year)
+    if year_dir is None:
+        return None
+
+    try:
+        index = _get_year_index(year, year_dir)
+    except FileNotFoundError:
+        logger.error("Unexpected FileNotFoundError while searching in %s", year_dir)
+        return None
+    return index.by_stem.get(name_stem)
+
+
 # --- Certificate Routes ---
 @certificates_router.get("/healthcheck")
 def certificates_healthcheck():
@@ -154,19 +498,18 @@ async def get_certificates_homepage(request: Request):  # Renamed for clarity
     Serve the homepage for certificates.
     """
     context = {
-        "request": request,
         "title": "DIPY Certificates",
         "supported_years": SUPPORTED_YEARS
     }
-    return templates.TemplateResponse("index.html", context)
+    return templates.TemplateResponse(request, "index.html", context)
 
 
 @certificates_router.post("/search", name="search_certificates_page",
                           response_class=HTMLResponse)
-async def search_certificates_page(  # Renamed for clarity
+def search_certificates_page(  # Renamed for clarity
     request: Request,
     search_query: str = Form(..., max_length=100),
-    search_year: str = Form(..., max_length=4)
+    search_year: str = Form(..., pattern=YEAR_PARAM_PATTERN)
 ):
     """
     Handle the certificate search request from the homepage.
@@ -190,7 +533,7 @@ async def search_certificates_page(  # Renamed for clarity
     HTMLResponse
         An HTML snippet with the search results.
     """
-    print(f"Searching for '{search_query}' in year '{search_year}'")  # Debug print
+    logger.debug("Searching for '%s' in year '%s'", search_query, search_year)
     certificate_path = find_certificate(search_query, search_year)
     certificate_name = certificate_path.stem if certificate_path else None
     linkedin_url = None
@@ -202,27 +545,22 @@ async def search_certificates_page(  # Renamed for clarity
                 'view_certificate_page', year=search_year, name_stem=certificate_name
             )
         except Exception as e:
-            print(f"Error generating URL for view_certificate_page: {e}")
+            logger.error("Error generating URL for view_certificate_page: %s", e)
             cert_page_url = ""  # Handle error case
 
-        # Prepare parameters for LinkedIn URL
-        params = {
-            "name": certificate_name,
-            "organizationId": ORGANIZATION_ID,
-            "issueYear": search_year,  # Use selected year
-            "issueMonth": ISSUE_MONTH,  # Use configured default month
-            # Ensure certUrl is a string and fits within line limits
-            "certUrl": str(cert_page_url)
-        }
-        # URL-encode parameters
-        encoded_params = urllib.parse.urlencode(params)
-        linkedin_url = f"{LINKEDIN_CERT_URL}&{encoded_params}"
+        # Only the name, year and certificate URL vary between searches; the
+        # year is already validated as 4 digits so it needs no quoting.
+        linkedin_url = (
+            f"{LINKEDIN_STATIC_URL}&issueYear={search_year}"
+            f"&name={quote_plus(certificate_name)}"
+            f"&certUrl={quote_plus(str(cert_page_url))}"
+        )
 
     # Pass search_year to the template for link generation
     return templates.TemplateResponse(
+        request,
         "results.html",
         {
-            "request": request,
             "certificate_name": certificate_name,
             "linkedin_url": linkedin_url,
             "not_found": certificate_path is None,
@@ -236,15 +574,21 @@ async def search_certificates_page(  # Renamed for clarity
 @certificates_router.get(
     "/download/{year}/{name_stem}.pdf", name="download_certificate_file"
 )
-async def download_certificate_file(year: str, name_stem: str):  # Renamed
+def download_certificate_file(  # Renamed
+    request: Request,
+    year: str = Path(..., pattern=YEAR_PARAM_PATTERN),
+    name_stem: str = Path(..., max_length=200, pattern=NAME_STEM_PARAM_PATTERN)
+):
     """
     Serve a specific certificate file for download, ensuring year match.
 
-    This route re-validates the path by calling find_certificate with the
-    provided year and name stem.
+    This route re-validates the path by looking up the exact name stem in
+    the cached index of the provided year.
 
     Parameters
     ----------
+    request : Request
+        The incoming request object, used for conditional requests.
     year : str
         The year directory containing the certificate.
     name_stem : str
@@ -252,44 +596,45 @@ async def download_certificate_file(year: str, name_stem: str):  # Renamed
 
     Returns
     -------
-    FileResponse
-        The PDF file response for downloading.
+    Response
+        The PDF file response for downloading, or an empty 304 Not Modified
+        response if the client already has the current file.
 
     Raises
     ------
     HTTPException
         404 Not Found if the certificate file doesn't exist within that year.
     """
-    # Re-run find_certificate for validation. Use a high threshold for exact match.
-    # Note: We search using the *stem* as the query here.
-    certificate_path = find_certificate(
-        search_name=name_stem, search_year=year, min_score_threshold=95
-    )
+    # The stem is known exactly, so look it up directly instead of fuzzy
+    # searching the whole year again.
+    certificate_path = get_certificate_by_stem(name_stem, year)
 
-    if not certificate_path or certificate_path.stem != name_stem:
-        # Extra check to ensure the found stem matches the requested stem exactly
+    if not certificate_path:
         raise HTTPException(
             status_code=404, detail="Certificate not found or name mismatch"
         )
 
-    return FileResponse(
-        path=certificate_path,
-        filename=certificate_path.name,
-        media_type='application/pdf',
-        content_disposition_type="attachment"
+    return certificate_file_response(
+        request, certificate_path, content_disposition_type="attachment"
     )
 
 
 @certificates_router.get("/view/{year}/{name_stem}.pdf", name="view_certificate_page")
-async def view_certificate_page(year: str, name_stem: str):
+def view_certificate_page(
+    request: Request,
+    year: str = Path(..., pattern=YEAR_PARAM_PATTERN),
+    name_stem: str = Path(..., max_length=200, pattern=NAME_STEM_PARAM_PATTERN)
+):
     """
     Serve a specific certificate file for viewing, ensuring year match.
 
-    This route re-validates the path by calling find_certificate with the
-    provided year and name stem.
+    This route re-validates the path by looking up the exact name stem in
+    the cached index of the provided year.
 
     Parameters
     ----------
+    request : Request
+        The incoming request object, used for conditional requests.
     year : str
         The year directory containing the certificate.
     name_stem : str
@@ -297,80 +642,115 @@ async def view_certificate_page(year: str, name_stem: str):
 
     Returns
     -------
-    FileResponse
-        The PDF file response for inline viewing.
+    Response
+        The PDF file response for inline viewing, or an empty 304 Not Modified
+        response if the client already has the current file.
 
     Raises
     ------
     HTTPException
         404 Not Found if the certificate file doesn't exist within that year.
     """
-    # Re-run find_certificate for validation. Use a high threshold for exact match.
-    # Note: We search using the *stem* as the query here.
-    certificate_path = find_certificate(
-        search_name=name_stem, search_year=year, min_score_threshold=95
-    )
+    # The stem is known exactly, so look it up directly instead of fuzzy
+    # searching the whole year again.
+    certificate_path = get_certificate_by_stem(name_stem, year)
 
-    if not certificate_path or certificate_path.stem != name_stem:
-        # Extra check to ensure the found stem matches the requested stem exactly
+    if not certificate_path:
         raise HTTPException(
             status_code=404, detail="Certificate not found or name mismatch"
         )
 
-    return FileResponse(
-        path=certificate_path,
-        filename=certificate_path.name,
-        media_type='application/pdf',
-        content_disposition_type="inline"  # Suggest viewing in browser
+    # Suggest viewing in browser
+    return certificate_file_response(
+        request, certificate_path, content_disposition_type="inline"
     )
 
 
 # --- Webhook Helper Functions ---
+# Two webhooks arriving close together must run the same website update one
+# after the other instead of racing on git pull. Deliveries may reach any
+# worker process, so runs are serialized with an flock on a lock file next
+# to the script; the per-script asyncio lock keeps deliveries to the same
+# worker queued on the event loop rather than each holding a thread.
+_update_script_locks: dict[pathlib.Path, asyncio.Lock] = {}
+
+
 async def _run_update_script(script_path: pathlib.Path, webhook_name: str):
-    try:
-        result = subprocess.run(
-            ["stdbuf", "-oL", str(script_path.absolute())],
-            # capture_output=True,
-            # text=True,
-            check=True
-        )
-        print(f"Update script output ({script_path.name})")  # : {result.stdout}")
-        return JSONResponse(
-            content={
-                "status": "success",
-                "message": f"{webhook_name} updated successfully"
-            }
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"Error running update script ({script_path.name}): {e.stderr}")
-        return JSONResponse(
-            content={
-                "status": "error",
-                "message": f"Script error for {webhook_name}: {e.stderr}"
-            },
-            status_code=500
+    lock = _update_script_locks.setdefault(script_path, asyncio.Lock())
+    lock_path = script_path.with_name(f".{script_path.name}.lock")
+    async with lock:
+        # The flock is released when the lock file is closed
+        with open(lock_path, "w") as lock_file:
+            # flock blocks until the other worker's run is done, so wait for
+            # it in a thread
+            await anyio.to_thread.run_sync(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            # Run the script as an asyncio subprocess so the event loop keeps
+            # serving other requests. Its output goes straight to the app log.
+            process = await asyncio.create_subprocess_exec(
+                "stdbuf", "-oL", str(script_path.absolute())
+            )
+            returncode = await process.wait()
+    if returncode != 0:
+        logger.error(
+            "Error running update script (%s) for %s: exit code %s",
+            script_path.name, webhook_name, returncode
         )
+    else:
+        logger.info("%s updated successfully (%s)", webhook_name, script_path.name)
+
+
+def _queue_update_script(
+    background_tasks: BackgroundTasks,
+    script_path: pathlib.Path,
+    webhook_name: str
+):
+    # GitHub only needs a prompt acknowledgement, so the update runs after
+    # the response has been sent instead of on the request critical path.
+    background_tasks.add_task(_run_update_script, script_path, webhook_name)
+    return OrjsonResponse(
+        content={
+            "status": "queued",
+            "message": f"{webhook_name} update queued"
+        },
+        status_code=202
+    )
 
 
 async def _verify_github_signature_and_parse(
     request: Request, x_hub_signature_256: Optional[str]
 ):
-    payload_bytes = await request.body()
-    if GITHUB_SECRET:
-        if not x_hub_signature_256:
-            raise HTTPException(
-                status_code=401, detail="Missing X-Hub-Signature-256 header")
-        signature = hmac.new(
-            GITHUB_SECRET.encode(),
-            msg=payload_bytes,
-            digestmod=hashlib.sha256
-        ).hexdigest()
-        expected_signature = f"sha256={signature}"
-        if not hmac.compare_digest(expected_signature, x_hub_signature_256):
+    # Reject what we can from the headers alone, before buffering the body
+    if _GITHUB_HMAC and not x_hub_signature_256:
+        raise HTTPException(
+            status_code=401, detail="Missing X-Hub-Signature-256 header")
+    try:
+        content_length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_WEBHOOK_BYTES:
+        raise HTTPException(status_code=413, detail="Payload too large")
+
+    # Content-Length may be absent (chunked uploads) or wrong, so the limit
+    # is also enforced on the bytes actually received.
+    payload_bytes = bytearray()
+    async for chunk in request.stream():
+        payload_bytes += chunk
+        if len(payload_bytes) > MAX_WEBHOOK_BYTES:
+            raise HTTPException(status_code=413, detail="Payload too large")
+
+    if _GITHUB_HMAC:
+        # Compare as bytes. Starlette decodes headers as latin-1, so this
+        # encoding gives back the raw header bytes for any header value.
+        mac = _GITHUB_HMAC.copy()
+        mac.update(payload_bytes)
+        expected_signature = b"sha256=" + hexlify(mac.digest())
+        if not hmac.compare_digest(
+            expected_signature, x_hub_signature_256.encode("latin-1")
+        ):
             raise HTTPException(status_code=401, detail="Invalid signature")
     try:
-        payload = json.loads(payload_bytes)
-    except json.JSONDecodeError:
+        payload = orjson.loads(payload_bytes)
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
     return payload
 
@@ -378,6 +758,7 @@ async def _verify_github_signature_and_parse(
 async def _process_github_event(
     request: Request,
     payload: dict,
+    background_tasks: BackgroundTasks,
     script_path: pathlib.Path,
     webhook_name: str
 ):
@@ -386,7 +767,7 @@ async def _process_github_event(
 
     if event_type == "ping":
         # Respond to GitHub ping event for webhook setup/test
-        return JSONResponse(
+        return OrjsonResponse(
             content={
                 "status": "ok",
                 "message": f"Ping event received for {webhook_name}",
@@ -398,13 +779,15 @@ async def _process_github_event(
         if payload.get("pull_request", {}).get("merged"):
             base_branch = payload.get("pull_request", {}).get("base", {}).get("ref")
             if base_branch in ["main", "master"]:
-                return await _run_update_script(script_path, webhook_name)
+                return _queue_update_script(
+                    background_tasks, script_path, webhook_name)
     elif event_type == "push":
         ref = payload.get("ref")
         if ref in ["refs/heads/main", "refs/heads/master"]:
-            return await _run_update_script(script_path, webhook_name)
+            return _queue_update_script(
+                background_tasks, script_path, webhook_name)
 
-    return JSONResponse(
+    return OrjsonResponse(
         content={
             "status": "ignored",
             "message":
@@ -419,23 +802,28 @@ def webhook_healthcheck():
     return {"message": "Hello from FastAPI Webhook Service!"}
 
 
-@webhooks_router.post("/lab", response_class=JSONResponse)
+@webhooks_router.post("/lab", response_class=OrjsonResponse)
 async def github_webhook_lab(
-    request: Request, x_hub_signature_256: Optional[str] = Header(None)
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_hub_signature_256: Optional[str] = Header(None)
 ):
     payload = await _verify_github_signature_and_parse(request, x_hub_signature_256)
     return await _process_github_event(
-        request, payload, UPDATE_LAB_SCRIPT_PATH, "Lab Website"
+        request, payload, background_tasks, UPDATE_LAB_SCRIPT_PATH, "Lab Website"
     )
 
 
-@webhooks_router.post("/workshop", response_class=JSONResponse)
+@webhooks_router.post("/workshop", response_class=OrjsonResponse)
 async def github_webhook_workshop(
-    request: Request, x_hub_signature_256: Optional[str] = Header(None)
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_hub_signature_256: Optional[str] = Header(None)
 ):
     payload = await _verify_github_signature_and_parse(request, x_hub_signature_256)
     return await _process_github_event(
-        request, payload, UPDATE_WORKSHOP_SCRIPT_PATH, "Workshop Website"
+        request, payload, background_tasks,
+        UPDATE_WORKSHOP_SCRIPT_PATH, "Workshop Website"
     )
 
 # Include the routers in the main app
@@ -452,7 +840,7 @@ async def services_status(request: Request):
     """
     Return a static status page listing all available services (API routers).
     """
-    return templates.TemplateResponse("services_status.html", {"request": request})
+    return templates.TemplateResponse(request, "services_status.html")
 
 
 @app.get("/")
@@ -472,14 +860,24 @@ if __name__ == "__main__":
     print(f"Starting server. Certificates expected in: {CERTIFICATES_DIR.resolve()}")
     print(f"Static files served from: {STATIC_DIR.resolve()}")
     print(f"Templates loaded from: {TEMPLATES_DIR.resolve()}")
-    if not CERTIFICATES_DIR.exists():
+    # A single scandir tells both whether the directory exists and whether
+    # it has any entry, without listing it completely.
+    try:
+        with os.scandir(CERTIFICATES_DIR) as it:
+            certificates_dir_empty = next(it, None) is None
+    except FileNotFoundError:
         print(
             f"Warning: Certificate directory '{CERTIFICATES_DIR}' not found. "
             "Please create it and add PDF certificates."
         )
-    elif not any(CERTIFICATES_DIR.iterdir()):
-        print(f"Warning: Certificate directory '{CERTIFICATES_DIR}' is empty.")
+    else:
+        if certificates_dir_empty:
+            print(f"Warning: Certificate directory '{CERTIFICATES_DIR}' is empty.")
 
+    # uvloop and httptools come with uvicorn[standard]. WEB_CONCURRENCY sets
+    # the number of worker processes (2 * CPUs + 1 by default).
     uvicorn.run(
-        "main:app", host="0.0.0.0", port=8000, reload=False
+        "main:app", host="0.0.0.0", port=8000, reload=False,
+        workers=int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1)),
+        loop="uvloop", http="httptools", access_log=False
     )
@@ -0,0 +1,10 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One client, and one run of the app lifespan, for the whole test session
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,145 @@
+import html
+import re
+from urllib.parse import parse_qs, urlencode, urlsplit
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import (
+    app, find_certificate, get_certificate_by_stem,
+    invalidate_certificate_index
+)
+
+
+@pytest.fixture
+def certificates_dir(tmp_path, monkeypatch):
+    year_dir = tmp_path / "2024"
+    (year_dir / "workshop").mkdir(parents=True)
+    (year_dir / "Jane Doe.pdf").write_bytes(b"%PDF-1.4")
+    (year_dir / "workshop" / "John Smith.pdf").write_bytes(b"%PDF-1.4")
+    monkeypatch.setattr(main, "CERTIFICATES_DIR", tmp_path)
+    invalidate_certificate_index()
+    yield tmp_path
+    invalidate_certificate_index()
+
+
+def test_find_certificate_recursive(certificates_dir):
+    path = find_certificate("john smith", "2024")
+    assert path == certificates_dir / "2024" / "workshop" / "John Smith.pdf"
+
+
+def test_find_certificate_prefers_exact_stem(certificates_dir):
+    # "Jane Doe" is a perfect partial match for both files
+    (certificates_dir / "2024" / "Dr Jane Doe.pdf").write_bytes(b"%PDF-1.4")
+    path = find_certificate("jane doe", "2024")
+    assert path == certificates_dir / "2024" / "Jane Doe.pdf"
+    assert find_certificate("  Jane DOE ", "2024") == path
+
+
+def test_find_certificate_no_match(certificates_dir):
+    assert find_certificate("Zzyzx Qwerty", "2024") is None
+    assert find_certificate("Jane Doe", "2023") is None
+    assert find_certificate("Jane Doe", "20x4") is None
+
+
+def test_find_certificate_unsupported_year(certificates_dir):
+    (certificates_dir / "1999").mkdir()
+    (certificates_dir / "1999" / "Jane Doe.pdf").write_bytes(b"%PDF-1.4")
+    assert find_certificate("Jane Doe", "1999") is None
+    assert get_certificate_by_stem("Jane Doe", "1999") is None
+
+
+def test_find_certificate_sees_new_files(certificates_dir):
+    assert find_certificate("Ada Lovelace", "2024") is None
+    new_cert = certificates_dir / "2024" / "workshop" / "Ada Lovelace.pdf"
+    new_cert.write_bytes(b"%PDF-1.4")
+    assert find_certificate("Ada Lovelace", "2024") == new_cert
+
+
+def test_get_certificate_by_stem_is_exact(certificates_dir):
+    path = get_certificate_by_stem("John Smith", "2024")
+    assert path == certificates_dir / "2024" / "workshop" / "John Smith.pdf"
+    assert get_certificate_by_stem("john smith", "2024") is None
+    assert get_certificate_by_stem("John Smit", "2024") is None
+    assert get_certificate_by_stem("John Smith", "..") is None
+
+
+def test_download_and_view_certificate(client, certificates_dir):
+    response = client.get("/services/certificates/download/2024/Jane Doe.pdf")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.headers["content-disposition"].startswith("attachment")
+
+    response = client.get("/services/certificates/view/2024/Jane Doe.pdf")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].startswith("inline")
+
+    response = client.get("/services/certificates/view/2024/Jane Do.pdf")
+    assert response.status_code == 404
+
+
+def test_invalid_year_rejected_before_lookup(client, certificates_dir):
+    response = client.get("/services/certificates/view/20x4/Jane Doe.pdf")
+    assert response.status_code == 422
+    response = client.get("/services/certificates/view/2024/..pdf")
+    assert response.status_code == 422
+    response = client.get("/services/certificates/view/2024/O'Brien, Jane.pdf")
+    assert response.status_code == 404
+    response = client.post(
+        "/services/certificates/search",
+        data={"search_query": "Jane Doe", "search_year": "../x"},
+    )
+    assert response.status_code == 422
+
+
+def test_startup_warms_certificate_index(certificates_dir):
+    with TestClient(app):
+        assert "2024" in main._cert_index
+        assert "2023" not in main._cert_index
+
+
+def test_certificate_conditional_request(client, certificates_dir):
+    url = "/services/certificates/view/2024/Jane Doe.pdf"
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public")
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    (certificates_dir / "2024" / "Jane Doe.pdf").write_bytes(b"%PDF-1.7 new")
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_search_builds_linkedin_link(client, certificates_dir):
+    (certificates_dir / "2024" / "Zoë O'Brien.pdf").write_bytes(b"%PDF-1.4")
+    response = client.post(
+        "/services/certificates/search",
+        data={"search_query": "Zoë O'Brien", "search_year": "2024"},
+    )
+    assert response.status_code == 200
+    hrefs = [
+        html.unescape(href) for href in re.findall(r'href="([^"]+)"', response.text)
+    ]
+    linkedin_url = next(
+        href for href in hrefs if href.startswith(main.LINKEDIN_CERT_URL)
+    )
+    # "View PDF" and LinkedIn's certUrl both point at the /view route
+    cert_url = "http://testserver/services/certificates/view/2024/Zoë O'Brien.pdf"
+    assert cert_url in hrefs
+
+    # Same parameters as the urlencode-based link this replaced
+    expected_params = urlencode({
+        "name": "Zoë O'Brien",
+        "organizationId": main.ORGANIZATION_ID,
+        "issueYear": "2024",
+        "issueMonth": main.ISSUE_MONTH,
+        "certUrl": cert_url,
+    })
+    expected_url = f"{main.LINKEDIN_CERT_URL}&{expected_params}"
+    assert parse_qs(urlsplit(linkedin_url).query) == parse_qs(
+        urlsplit(expected_url).query
+    )
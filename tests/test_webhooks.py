@@ -1,41 +1,80 @@
-import json
+import asyncio
+import fcntl
+import orjson
 import hmac
 import hashlib
-from fastapi.testclient import TestClient
-from main import app, GITHUB_SECRET
+import pytest
+import main
+from main import GITHUB_SECRET
 
-client = TestClient(app)
 
+# Keyed once; each signature starts from a copy, like the verifier in main
+_HMAC_PROTOTYPE = hmac.new((GITHUB_SECRET or "test").encode(), b"", hashlib.sha256)
 
-def generate_signature(secret, payload_bytes):
-    signature = hmac.new(
-        secret.encode(), payload_bytes, hashlib.sha256
-    ).hexdigest()
-    return f"sha256={signature}"
 
+def generate_signature(payload_bytes):
+    digest = _HMAC_PROTOTYPE.copy()
+    digest.update(payload_bytes)
+    return f"sha256={digest.hexdigest()}"
 
-def test_lab_webhook_push():
-    payload = {"ref": "refs/heads/main"}
-    payload_bytes = json.dumps(payload).encode()
-    signature = generate_signature(GITHUB_SECRET or "test", payload_bytes)
+
+# Built once and shared by every test that posts a well-formed push event
+PUSH_PAYLOAD_BYTES = orjson.dumps({"ref": "refs/heads/main"})
+PUSH_SIGNATURE = generate_signature(PUSH_PAYLOAD_BYTES)
+
+
+@pytest.fixture
+def webhook_secret(monkeypatch):
+    # Verify signatures whether or not a secret is set in the environment
+    monkeypatch.setattr(main, "_GITHUB_HMAC", _HMAC_PROTOTYPE)
+
+
+@pytest.fixture
+def update_script_calls(monkeypatch):
+    # Record queued updates instead of running the real deploy scripts
+    calls = []
+
+    async def fake_run_update_script(script_path, webhook_name):
+        calls.append((script_path, webhook_name))
+
+    monkeypatch.setattr(main, "_run_update_script", fake_run_update_script)
+    return calls
+
+
+def test_lab_webhook_push(client, update_script_calls):
     response = client.post(
         "/services/webhooks/lab",
-        data=payload_bytes,
+        data=PUSH_PAYLOAD_BYTES,
         headers={
             "X-GitHub-Event": "push",
-            "X-Hub-Signature-256": signature,
+            "X-Hub-Signature-256": PUSH_SIGNATURE,
+            "Content-Type": "application/json"
+        },
+    )
+    # The update script runs in the background after the response is sent
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    assert update_script_calls == [(main.UPDATE_LAB_SCRIPT_PATH, "Lab Website")]
+
+
+def test_lab_webhook_invalid_signature(client, webhook_secret, update_script_calls):
+    response = client.post(
+        "/services/webhooks/lab",
+        data=PUSH_PAYLOAD_BYTES,
+        headers={
+            "X-GitHub-Event": "push",
+            # Use a wrong signature
+            "X-Hub-Signature-256": "sha256=deadbeef",
             "Content-Type": "application/json"
         },
     )
-    assert response.status_code in (200, 500)  # 500 if script fails, 200 if success
-    assert response.json()["status"] in ("success", "error", "ignored")
+    assert response.status_code == 401
+    assert update_script_calls == []
 
 
-def test_lab_webhook_invalid_signature():
-    payload = {"ref": "refs/heads/main"}
-    payload_bytes = json.dumps(payload).encode()
-    # Use a wrong signature
-    signature = "sha256=deadbeef"
+def test_lab_webhook_invalid_json(client):
+    payload_bytes = b"{not json"
+    signature = generate_signature(payload_bytes)
     response = client.post(
         "/services/webhooks/lab",
         data=payload_bytes,
@@ -45,4 +84,97 @@ def test_lab_webhook_invalid_signature():
             "Content-Type": "application/json"
         },
     )
+    assert response.status_code == 400
+
+
+def test_lab_webhook_missing_signature(client, webhook_secret):
+    response = client.post(
+        "/services/webhooks/lab",
+        data=b"{}",
+        headers={"X-GitHub-Event": "push", "Content-Type": "application/json"},
+    )
     assert response.status_code == 401
+
+
+def test_lab_webhook_payload_too_large(client):
+    response = client.post(
+        "/services/webhooks/lab",
+        data=b"{}",
+        headers={
+            "X-GitHub-Event": "push",
+            "X-Hub-Signature-256": "sha256=deadbeef",
+            "Content-Type": "application/json",
+            "Content-Length": str(26 * 1024 * 1024),
+        },
+    )
+    assert response.status_code == 413
+
+
+def test_lab_webhook_non_ascii_signature(client, webhook_secret):
+    response = client.post(
+        "/services/webhooks/lab",
+        data=PUSH_PAYLOAD_BYTES,
+        headers={
+            "X-GitHub-Event": "push",
+            "X-Hub-Signature-256": "sha256=d\xe9adbeef".encode("latin-1"),
+            "Content-Type": "application/json"
+        },
+    )
+    assert response.status_code == 401
+
+
+def test_lab_webhook_chunked_payload_too_large(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_WEBHOOK_BYTES", 16)
+
+    def chunks():
+        yield b'{"ref": "refs/heads/main",'
+        yield b' "padding": "xxxxxxxxxxxxxxxx"}'
+
+    response = client.post(
+        "/services/webhooks/lab",
+        content=chunks(),
+        headers={
+            "X-GitHub-Event": "push",
+            "X-Hub-Signature-256": "sha256=deadbeef",
+            "Content-Type": "application/json"
+        },
+    )
+    assert response.status_code == 413
+
+
+def test_update_script_waits_for_lock_held_by_another_worker(tmp_path):
+    marker = tmp_path / "ran"
+    script = tmp_path / "update.sh"
+    script.write_text(f"#!/bin/sh\ntouch '{marker}'\n")
+    script.chmod(0o755)
+
+    async def run_while_locked():
+        with open(tmp_path / ".update.sh.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            task = asyncio.create_task(main._run_update_script(script, "Test"))
+            await asyncio.sleep(0.2)
+            assert not marker.exists()
+        await task
+
+    asyncio.run(run_while_locked())
+    assert marker.exists()
+
+
+def test_run_update_script_logs_exit_code(tmp_path, monkeypatch):
+    errors = []
+    successes = []
+    monkeypatch.setattr(main.logger, "error", lambda *args: errors.append(args))
+    monkeypatch.setattr(main.logger, "info", lambda *args: successes.append(args))
+    ok_script = tmp_path / "ok.sh"
+    ok_script.write_text("#!/bin/sh\nexit 0\n")
+    failing_script = tmp_path / "failing.sh"
+    failing_script.write_text("#!/bin/sh\nexit 3\n")
+    ok_script.chmod(0o755)
+    failing_script.chmod(0o755)
+
+    asyncio.run(main._run_update_script(ok_script, "Test"))
+    assert successes and not errors
+
+    asyncio.run(main._run_update_script(failing_script, "Test"))
+    assert len(errors) == 1
+    assert errors[0][1:] == ("failing.sh", "Test", 3)